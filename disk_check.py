@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Oct 19 13:40:22 2026
+
+@authors: Andrea Bassi. Politecnico di Milano
+
+Checks that the saving directory can absorb the data rate of a time-lapse,
+before and during the acquisition.
+"""
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+
+MB = 1024**2
+GB = 1024**3
+BENCHMARK_SIZE = 64*MB
+
+
+def bytes_per_timepoint(img_shape, dtype, camera_num, frame_num):
+    return int(np.prod(img_shape)) * np.dtype(dtype).itemsize * camera_num * frame_num
+
+
+def free_space(directory):
+    return shutil.disk_usage(directory).free
+
+
+def benchmark_write_speed(directory, size=BENCHMARK_SIZE, block_size=8*MB):
+    """
+    Writes and syncs a temporary file of the given size in directory.
+    Returns the write speed in bytes/s
+    """
+    block_size = min(block_size, size)
+    block = os.urandom(block_size)
+    blocks_num = max(size // block_size, 1)
+    fd, fname = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        t0 = time.perf_counter()
+        with os.fdopen(fd, 'wb') as f:
+            for _ in range(blocks_num):
+                f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+        elapsed = time.perf_counter() - t0
+    finally:
+        os.remove(fname)
+    return blocks_num * block_size / elapsed
+
+
+def preflight(directory, timepoint_bytes, projection_bytes, time_lapse_num,
+              waiting_time, margin, allow_projections):
+    """
+    Estimates the space and the sustained rate needed by the time-lapse and
+    compares them with the free space and the write speed of directory.
+    Returns (ok, messages): ok is False if the run should not be started.
+    """
+    messages = []
+    ok = True
+    total = timepoint_bytes * time_lapse_num
+    rate = timepoint_bytes / waiting_time if waiting_time > 0 else float('inf')
+    free = free_space(directory) - margin
+    messages.append(f'{timepoint_bytes/MB:.1f} MB per timepoint, '
+                    f'{total/GB:.2f} GB in total, {rate/MB:.1f} MB/s sustained')
+    if total > free:
+        if allow_projections and projection_bytes * time_lapse_num <= free:
+            messages.append(f'only {free/GB:.2f} GB free in {directory}: '
+                            'the run will switch to projections when the disk gets full')
+        else:
+            messages.append(f'only {free/GB:.2f} GB free in {directory}: run refused')
+            ok = False
+    if not ok:
+        return ok, messages
+    # the benchmark file must not fill the disk itself
+    size = min(BENCHMARK_SIZE, int(free) // 4)
+    if size < MB:
+        messages.append('not enough free space to benchmark the write speed')
+        return ok, messages
+    try:
+        speed = benchmark_write_speed(directory, size)
+    except OSError as err:
+        messages.append(f'write speed benchmark failed: {err}')
+        return ok, messages
+    messages.append(f'write speed of {directory}: {speed/MB:.1f} MB/s')
+    if speed < rate:
+        messages.append('the disk is slower than the data rate: the acquisition will fall behind')
+        if allow_projections:
+            messages.append('the run will switch to projections if it falls behind')
+    return ok, messages
+
+
+CONTINUE = 'continue'
+SLOW = 'slow'
+PROJECTIONS = 'projections'
+STOP = 'stop'
+
+
+def check_timepoint(directory, margin, timepoint_bytes, projection_bytes,
+                    write_time, camera_time, waiting_time,
+                    projection_only, allow_projections):
+    """
+    Decides how to continue after a timepoint, from the free space of directory
+    and from the throughput achieved while writing it.
+    write_time: time spent writing the timepoint
+    camera_time: rest of the time of the timepoint (LED init and camera burst)
+    Returns (action, reason), action being CONTINUE, SLOW, PROJECTIONS or STOP
+    """
+    free = free_space(directory) - margin
+    space_reason = f'{free/GB:.2f} GB left in {directory}'
+    if projection_only:
+        if free < projection_bytes:
+            return STOP, space_reason
+        return CONTINUE, ''
+    if free < timepoint_bytes:
+        if allow_projections and free >= projection_bytes:
+            return PROJECTIONS, space_reason
+        return STOP, space_reason
+    # The disk is too slow only if the writes do not fit in the time left by the cameras.
+    # When the cameras alone take the whole interval (e.g. back-to-back timepoints)
+    # the delay is not caused by the disk.
+    time_for_writing = waiting_time - camera_time
+    if time_for_writing > 0 and write_time > 0:
+        throughput = timepoint_bytes / write_time
+        required = timepoint_bytes / time_for_writing
+        if throughput < required:
+            reason = f'{throughput/MB:.1f} MB/s written, {required/MB:.1f} MB/s needed'
+            if allow_projections:
+                return PROJECTIONS, reason
+            return SLOW, reason
+    return CONTINUE, ''
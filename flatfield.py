@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Oct 19 12:31:54 2026
+
+@authors: Andrea Bassi. Politecnico di Milano
+
+Dark-frame and flat-field correction.
+The dark and flat references of each camera are recorded by PlantCalibrationMeasure
+and cached in calibration_dir, one file for each camera, exposure and gain.
+The corrected image is (img - dark) * mean(flat - dark) / (flat - dark)
+"""
+import numpy as np
+import os
+
+CALIBRATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Calibration')
+
+
+def calibration_fname(calibration_dir, camera_hw):
+    exposure = camera_hw.settings['exposure_time']
+    gain = camera_hw.settings['gain']
+    return os.path.join(calibration_dir,
+                        f'{camera_hw.name}_exp{exposure:.1f}_gain{gain:.1f}.npz')
+
+
+def save_calibration(fname, dark, flat):
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    np.savez(fname, dark=dark, flat=flat)
+
+
+def load_corrector(calibration_dir, camera_hw):
+    """
+    Returns the FlatFieldCorrector for the current exposure and gain of the camera,
+    or None if the camera has not been calibrated with these settings
+    """
+    fname = calibration_fname(calibration_dir, camera_hw)
+    if not os.path.isfile(fname):
+        print('no flat-field calibration found for', camera_hw.name, ':', fname)
+        return None
+    with np.load(fname) as calibration:
+        corrector = FlatFieldCorrector(calibration['dark'], calibration['flat'])
+    corrector.fname = fname
+    shape = (camera_hw.settings['image_height'], camera_hw.settings['image_width'])
+    if corrector.shape != shape:
+        print('flat-field calibration', fname, 'has shape', corrector.shape,
+              'but', camera_hw.name, 'acquires', shape)
+        return None
+    return corrector
+
+
+class FlatFieldCorrector:
+    """
+    The gain map is computed once. The corrections are done in place in
+    two preallocated float buffers, used alternately: the image returned
+    by a call is valid until the next-but-one call, and must be copied
+    if it is kept longer (e.g. by the display).
+    """
+
+    def __init__(self, dark, flat):
+        self.dark = dark.astype(np.float32)
+        signal = flat.astype(np.float32) - self.dark
+        valid = signal > 0
+        self.gain = np.ones_like(signal)
+        if valid.any():
+            self.gain[valid] = signal[valid].mean() / signal[valid]
+        self.shape = self.dark.shape
+        self.fname = ''
+        self.buffers = [np.empty_like(self.dark), np.empty_like(self.dark)]
+        self.out_buffers = {}
+        self.buffer_idx = 0
+
+    def correct(self, img):
+        """
+        Returns the corrected image as float32
+        """
+        self.buffer_idx = 1 - self.buffer_idx
+        buffer = self.buffers[self.buffer_idx]
+        np.subtract(img, self.dark, out=buffer)
+        np.multiply(buffer, self.gain, out=buffer)
+        return buffer
+
+    def correct_to_dtype(self, img):
+        """
+        Returns the corrected image rounded and clipped to the dtype of img
+        """
+        buffer = self.correct(img)
+        info = np.iinfo(img.dtype)
+        np.clip(buffer, info.min, info.max, out=buffer)
+        np.rint(buffer, out=buffer)
+        key = (img.dtype.str, self.buffer_idx)
+        if key not in self.out_buffers:
+            self.out_buffers[key] = np.empty(self.shape, dtype=img.dtype)
+        out = self.out_buffers[key]
+        np.copyto(out, buffer, casting='unsafe')
+        return out
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Oct 19 10:12:03 2026
+
+@authors: Andrea Bassi. Politecnico di Milano
+
+Delta encoding of the frame stacks saved in h5.
+A dataset saved in delta mode contains keyframes, stored in full, and
+differences from the previous stored frame. The differences are computed
+modulo the integer range of the dtype (e.g. 2**16 for uint16), so the
+encoding is lossless and does not change the dtype. Frames whose change
+from the previous stored frame is below skip_threshold are not written at all.
+Unwritten chunks take no disk space in h5.
+"""
+import numpy as np
+
+KEYFRAME = 0
+DELTA = 1
+SKIPPED = 2
+
+
+def create_delta_dataset(h5group, name, shape, dtype):
+    """
+    Creates a chunked (one chunk per frame), compressed image dataset
+    and the frame_type dataset that describes how each frame is stored.
+    Returns the image dataset and the frame_type dataset.
+    """
+    length, height, width = shape
+    dataset = h5group.create_dataset(name=name,
+                                     shape=shape,
+                                     dtype=dtype,
+                                     chunks=(1, height, width),
+                                     compression='gzip',
+                                     compression_opts=1,
+                                     shuffle=True)
+    frame_type = h5group.create_dataset(name=name + '_frame_type',
+                                        shape=[length],
+                                        dtype=np.uint8)
+    dataset.attrs['encoding'] = 'delta'
+    return dataset, frame_type
+
+
+class DeltaFrameEncoder:
+    """
+    Writes frames to a dataset created by create_delta_dataset.
+    Frames must be written in increasing index order.
+    """
+
+    def __init__(self, dataset, frame_type, keyframe_interval=10, skip_threshold=0.0):
+        """
+        keyframe_interval: number of stored frames between two keyframes.
+        skip_threshold: mean absolute difference (in counts) from the previous
+                        stored frame below which a frame is skipped.
+                        With 0 only frames identical to the previous one
+                        are skipped, and the encoding is lossless.
+        """
+        self.dataset = dataset
+        self.frame_type = frame_type
+        self.keyframe_interval = max(int(keyframe_interval), 1)
+        self.skip_threshold = skip_threshold
+        self.reference = None
+        self.stored_since_keyframe = 0
+        dataset.attrs['keyframe_interval'] = self.keyframe_interval
+        dataset.attrs['skip_threshold'] = skip_threshold
+
+    def is_unchanged(self, img):
+        if self.skip_threshold <= 0:
+            return np.array_equal(img, self.reference)
+        diff = np.abs(img.astype(np.int32) - self.reference)
+        return diff.mean() <= self.skip_threshold
+
+    def write(self, frame_idx, img):
+        if self.reference is None or self.stored_since_keyframe >= self.keyframe_interval:
+            self.dataset[frame_idx, :, :] = img
+            self.frame_type[frame_idx] = KEYFRAME
+            self.stored_since_keyframe = 1
+        elif self.is_unchanged(img):
+            # the previous stored frame is kept as reference
+            self.frame_type[frame_idx] = SKIPPED
+            return
+        else:
+            # unsigned subtraction wraps around and is undone by the addition in read_frame
+            self.dataset[frame_idx, :, :] = img - self.reference
+            self.frame_type[frame_idx] = DELTA
+            self.stored_since_keyframe += 1
+        self.reference = img.copy()
+
+
+class DeltaFrameReader:
+    """
+    Read-only view of a delta encoded dataset, that behaves like the
+    h5 dataset of the full frames. Frames are reconstructed when accessed.
+    The last reconstructed frame is kept, so sequential reading only
+    decodes one stored frame at a time.
+    """
+
+    def __init__(self, dataset, frame_type):
+        self.dataset = dataset
+        self.frame_type = frame_type[()]
+        self.shape = dataset.shape
+        self.dtype = dataset.dtype
+        self.attrs = dataset.attrs
+        self._cached_idx = None
+        self._cached_frame = None
+
+    def __len__(self):
+        return self.shape[0]
+
+    def stored_index(self, frame_idx):
+        """ index of the stored frame that a (possibly skipped) frame is equal to """
+        while self.frame_type[frame_idx] == SKIPPED:
+            frame_idx -= 1
+        return frame_idx
+
+    def read_frame(self, frame_idx):
+        if frame_idx < 0:
+            frame_idx += len(self)
+        if not 0 <= frame_idx < len(self):
+            raise IndexError(f'frame index {frame_idx} out of range')
+        target = self.stored_index(frame_idx)
+        if target == self._cached_idx:
+            return self._cached_frame.copy()
+        start = target
+        while self.frame_type[start] != KEYFRAME:
+            start -= 1
+        if self._cached_idx is not None and start <= self._cached_idx < target:
+            # continue from the cached frame instead of the keyframe
+            start = self._cached_idx
+            frame = self._cached_frame
+        else:
+            frame = self.dataset[start]
+        for idx in range(start + 1, target + 1):
+            if self.frame_type[idx] == DELTA:
+                frame = frame + self.dataset[idx]
+        self._cached_idx = target
+        self._cached_frame = frame
+        return frame.copy()
+
+    def __getitem__(self, key):
+        """
+        Supports the numpy indexing of h5py datasets on the frame axis:
+        integers, slices, integer and boolean arrays, () and ...
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) == 0 or key[0] is Ellipsis:
+            # all the frames, then the key is applied to the full stack
+            return self[:][key]
+        frame_key, pixel_key = key[0], key[1:]
+        if isinstance(frame_key, (int, np.integer)):
+            return self.read_frame(int(frame_key))[pixel_key]
+        if isinstance(frame_key, slice):
+            indices = range(*frame_key.indices(len(self)))
+        else:
+            indices = np.asarray(frame_key)
+            if indices.dtype == bool and indices.shape == (len(self),):
+                indices = np.flatnonzero(indices)
+            elif indices.ndim != 1 or not np.issubdtype(indices.dtype, np.integer):
+                raise TypeError(f'unsupported frame index: {frame_key!r}')
+        frames = [self.read_frame(int(idx))[pixel_key] for idx in indices]
+        if frames:
+            return np.stack(frames)
+        return np.empty((0,) + self.shape[1:], dtype=self.dtype)[(slice(None),) + pixel_key]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+
+def open_frames(h5group, name):
+    """
+    Returns the frames saved in h5group[name], reconstructing them
+    if the dataset was saved in delta mode.
+    Datasets saved in full are returned unchanged (lazily read by h5py).
+    """
+    dataset = h5group[name]
+    if dataset.attrs.get('encoding') == 'delta':
+        return DeltaFrameReader(dataset, h5group[name + '_frame_type'])
+    return dataset
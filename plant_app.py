@@ -38,6 +38,9 @@ class camera_app(BaseMicroscopeApp):
         from plant_timelapse_dual_measure import PlantTimeLapseDualMeasure
         self.add_measurement(PlantTimeLapseDualMeasure(self))
 
+        from plant_calibration_measure import PlantCalibrationMeasure
+        self.add_measurement(PlantCalibrationMeasure(self))
+
 
         self.ui.show()
         self.ui.activateWindow()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Oct 19 11:02:47 2026
+
+@authors: Andrea Bassi. Politecnico di Milano
+
+Batch processing of the time-lapse runs saved in a directory.
+The runs are discovered in save_dir, a manifest of the image datasets is
+built from their h5 attributes and the jobs are run over a process pool,
+one task per dataset (timepoint and camera).
+Processing is incremental: for each dataset the content hash and the
+completed jobs are kept in a cache file in the output directory,
+and datasets whose content did not change are not processed again.
+
+Usage:
+    python plant_batch.py C:\\data\\temp --jobs projection metrics --workers 4
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from frame_delta import open_frames
+import argparse
+import glob
+import hashlib
+import json
+import os
+
+import h5py
+import numpy as np
+
+MANIFEST_FILENAME = 'manifest.json'
+CACHE_FILENAME = 'batch_cache.json'
+
+
+def max_projection(frames, entry, out_prefix):
+    projection = frames.max(axis=0)
+    fname = out_prefix + '_max.npy'
+    np.save(fname, projection)
+    return {'file': os.path.basename(fname)}
+
+
+def frame_metrics(frames, entry, out_prefix):
+    return {'mean': frames.mean(axis=(1, 2)).tolist(),
+            'std': frames.std(axis=(1, 2)).tolist(),
+            'min': int(frames.min()),
+            'max': int(frames.max())}
+
+
+JOBS = {'projection': max_projection,
+        'metrics': frame_metrics}
+
+
+def discover_runs(save_dir, pattern='*_PlantTimeLapse*.h5'):
+    return sorted(glob.glob(os.path.join(save_dir, pattern)))
+
+
+def read_entries(fname):
+    """
+    Returns a manifest entry for each image dataset in the file
+    """
+    entries = []
+
+    def add_entry(name, obj):
+        if isinstance(obj, h5py.Dataset) and name.endswith('/image'):
+            attrs = obj.attrs
+            entries.append({'file': fname,
+                            'dataset': name,
+                            'time_idx': int(attrs.get('time_idx', 0)),
+                            'camera': name.split('/')[-2],
+                            'view': str(attrs.get('view', '')),
+                            'acquisition_time': float(attrs.get('acquisition_time', 0.0)),
+                            'element_size_um': [float(s) for s in attrs.get('element_size_um', [])],
+                            'shape': list(obj.shape),
+                            'encoding': str(attrs.get('encoding', 'raw'))})
+
+    with h5py.File(fname, 'r') as h5file:
+        h5file.visititems(add_entry)
+    return sorted(entries, key=lambda e: (e['time_idx'], e['camera']))
+
+
+def build_manifest(fnames):
+    manifest = []
+    for fname in fnames:
+        try:
+            manifest.extend(read_entries(fname))
+        except OSError as err:
+            # e.g. a file still open for writing by the acquisition
+            print('skipping', fname, ':', err)
+    return manifest
+
+
+def content_hash(frames, attrs):
+    h = hashlib.sha1()
+    h.update(str(frames.shape).encode())
+    h.update(str(frames.dtype).encode())
+    h.update(np.ascontiguousarray(frames).data)
+    for key in sorted(attrs):
+        h.update(key.encode())
+        h.update(str(attrs[key]).encode())
+    return h.hexdigest()
+
+
+def entry_key(entry):
+    return f"{os.path.basename(entry['file'])}:{entry['dataset']}"
+
+
+def process_entry(entry, jobs, out_dir, cached):
+    """
+    Runs in a worker process. Reads the dataset, compares its content hash
+    with the cached one and runs the jobs that were not done yet.
+    Returns the cache record of the dataset.
+    """
+    with h5py.File(entry['file'], 'r') as h5file:
+        frames = open_frames(h5file, entry['dataset'])[:]
+        attrs = dict(h5file[entry['dataset']].attrs)
+    digest = content_hash(frames, attrs)
+    if cached is None or cached['hash'] != digest:
+        cached = {'hash': digest, 'results': {}}
+    run_name = os.path.splitext(os.path.basename(entry['file']))[0]
+    run_dir = os.path.join(out_dir, run_name)
+    os.makedirs(run_dir, exist_ok=True)
+    out_prefix = os.path.join(run_dir, f"t{entry['time_idx']:04d}_{entry['camera']}")
+    for job in jobs:
+        if job not in cached['results']:
+            cached['results'][job] = JOBS[job](frames, entry, out_prefix)
+    return cached
+
+
+def load_cache(out_dir):
+    fname = os.path.join(out_dir, CACHE_FILENAME)
+    if os.path.isfile(fname):
+        with open(fname) as f:
+            return json.load(f)
+    return {}
+
+
+def save_json(obj, fname):
+    # write to a temporary file first, so an interrupted batch does not corrupt the cache
+    tmp_fname = fname + '.tmp'
+    with open(tmp_fname, 'w') as f:
+        json.dump(obj, f, indent=1)
+    os.replace(tmp_fname, fname)
+
+
+def is_done(entry, jobs, cache, mtimes):
+    """
+    A dataset is considered done without reading it if all the jobs are cached
+    and its file did not change since.
+    """
+    cached = cache.get(entry_key(entry))
+    if cached is None:
+        return False
+    return (cached.get('mtime') == mtimes[entry['file']]
+            and all(job in cached['results'] for job in jobs))
+
+
+def run_batch(save_dir, jobs, out_dir=None, workers=None, pattern='*_PlantTimeLapse*.h5'):
+    if out_dir is None:
+        out_dir = os.path.join(save_dir, 'processed')
+    os.makedirs(out_dir, exist_ok=True)
+
+    fnames = discover_runs(save_dir, pattern)
+    manifest = build_manifest(fnames)
+    save_json(manifest, os.path.join(out_dir, MANIFEST_FILENAME))
+    print('found', len(manifest), 'datasets in', len(fnames), 'runs')
+
+    cache = load_cache(out_dir)
+    mtimes = {fname: os.path.getmtime(fname) for fname in fnames}
+    todo = [e for e in manifest if not is_done(e, jobs, cache, mtimes)]
+    print('processing', len(todo), 'datasets')
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_entry, e, jobs, out_dir,
+                                   cache.get(entry_key(e))): e for e in todo}
+        for future in as_completed(futures):
+            entry = futures[future]
+            key = entry_key(entry)
+            try:
+                record = future.result()
+            except Exception as err:
+                print('failed', key, ':', err)
+                continue
+            record['mtime'] = mtimes[entry['file']]
+            cache[key] = record
+            save_json(cache, os.path.join(out_dir, CACHE_FILENAME))
+    return cache
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch processing of the time-lapse runs in a directory')
+    parser.add_argument('save_dir', help='directory with the h5 files of the runs')
+    parser.add_argument('--jobs', nargs='+', choices=list(JOBS), default=list(JOBS))
+    parser.add_argument('--out', dest='out_dir', default=None,
+                        help='output directory (default: save_dir/processed)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: number of cpus)')
+    parser.add_argument('--pattern', default='*_PlantTimeLapse*.h5')
+    args = parser.parse_args()
+
+    run_batch(args.save_dir, args.jobs, args.out_dir, args.workers, args.pattern)
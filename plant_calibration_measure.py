@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Oct 19 12:58:10 2026
+
+@authors: Andrea Bassi. Politecnico di Milano
+"""
+from ScopeFoundry import Measurement
+from flatfield import CALIBRATION_DIR, calibration_fname, save_calibration
+import numpy as np
+import time
+
+
+class PlantCalibrationMeasure(Measurement):
+
+    name = "PlantCalibrationMeasure"
+
+    def setup(self):
+        """
+        Runs once during App initialization.
+        Records, for each connected camera, the dark reference (LEDs off)
+        and the flat reference (LEDs on, without sample) as the average of
+        frames_num frames, and saves them in calibration_dir
+        for the current exposure and gain.
+        """
+        self.settings.New('frames_num', dtype=int, initial=20, vmin=1)
+        self.settings.New('LED_init_time', dtype=float, unit='s',
+                          initial=0.5, spinbox_decimals=3)
+        self.settings.New('calibration_dir', dtype='file', is_dir=True,
+                          initial=CALIBRATION_DIR)
+
+    def acquire_average(self, step, steps_num):
+        """
+        Acquires frames_num frames with all the cameras and
+        returns their average for each camera
+        """
+        frames_num = self.settings['frames_num']
+        sums = []
+        for c in self.cameras:
+            c.camera.acq_stop()
+            c.settings['acquisition_mode'] = 'MultiFrame'
+            c.camera.set_framenum(frames_num)
+            c.camera.acq_start()
+        for frame_idx in range(frames_num):
+            for cam_idx, c in enumerate(self.cameras):
+                img = c.camera.get_nparray()
+                if frame_idx == 0:
+                    sums.append(img.astype(np.float64))
+                else:
+                    sums[cam_idx] += img
+            self.settings['progress'] = (step*frames_num + frame_idx + 1) * 100/(steps_num*frames_num)
+            if self.interrupt_measurement_called:
+                break
+        for c in self.cameras:
+            c.camera.acq_stop()
+        return [(s/(frame_idx+1)).astype(np.float32) for s in sums]
+
+    def run(self):
+        self.cameras = []
+        self.leds = []
+        for view in ['y', 'x']:
+            if self.app.hardware[f'camera_{view}'].connected:
+                self.cameras.append(self.app.hardware[f'camera_{view}'])
+            if self.app.hardware[f'led_{view}'].connected:
+                self.leds.append(self.app.hardware[f'led_{view}'])
+
+        for c in self.cameras:
+            c.read_from_hardware()
+
+        try:
+            for L in self.leds:
+                L.turn_off()
+            darks = self.acquire_average(step=0, steps_num=2)
+            if self.interrupt_measurement_called:
+                return
+
+            for L in self.leds:
+                L.turn_on()
+            time.sleep(self.settings['LED_init_time']) # waiting time to turn on the LED
+            flats = self.acquire_average(step=1, steps_num=2)
+            if self.interrupt_measurement_called:
+                return
+
+            for c, dark, flat in zip(self.cameras, darks, flats):
+                fname = calibration_fname(self.settings['calibration_dir'], c)
+                save_calibration(fname, dark, flat)
+                print('flat-field calibration saved:', fname)
+        finally:
+            for L in self.leds:
+                L.turn_off()
+            for c in self.cameras:
+                c.camera.acq_stop()
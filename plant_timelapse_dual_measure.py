@@ -7,6 +7,10 @@ Created on Mar 20 12:45:26 2024
 from ScopeFoundry import Measurement
 from ScopeFoundry.helper_funcs import sibling_path, load_qt_ui_file
 from ScopeFoundry import h5_io
+from frame_delta import create_delta_dataset, DeltaFrameEncoder
+from thumbnails import ThumbnailWriter, ThumbnailViewer, THUMBNAIL_FACTORS
+from flatfield import CALIBRATION_DIR, load_corrector
+from disk_check import bytes_per_timepoint, check_timepoint, preflight, GB, SLOW, PROJECTIONS, STOP
 import pyqtgraph as pg
 import numpy as np
 import os
@@ -48,6 +52,27 @@ class PlantTimeLapseDualMeasure(Measurement):
         self.settings.New('save_h5', dtype=bool, initial=False)
         self.settings.New('refresh_period', dtype=float,
                           unit='s', spinbox_decimals=3, initial=0.05, vmin=0)
+        self.settings.New('delta_mode', dtype=bool, initial=False)
+        self.settings.New('keyframe_interval', dtype=int, initial=10, vmin=1)
+        self.settings.New('skip_threshold', dtype=float, unit='counts',
+                          initial=0.0, spinbox_decimals=2, vmin=0)
+        self.settings.New('save_thumbnails', dtype=bool, initial=True)
+        self.settings.New('flatfield_display', dtype=bool, initial=False)
+        self.settings.New('flatfield_save', dtype=bool, initial=False)
+        self.settings.New('calibration_dir', dtype='file', is_dir=True,
+                          initial=CALIBRATION_DIR)
+        self.settings.New('preflight_check', dtype=bool, initial=True)
+        self.settings.New('free_space_margin', dtype=float, unit='GB',
+                          initial=1.0, spinbox_decimals=1, vmin=0)
+        self.settings.New('allow_projections', dtype=bool, initial=True)
+        self.settings.New('browse_file', dtype='file', initial='')
+        self.settings.New('browse_factor', dtype=int, choices=list(THUMBNAIL_FACTORS),
+                          initial=THUMBNAIL_FACTORS[0])
+        self.add_operation('show_montage', self.show_montage)
+        self.viewer = None
+        self.thumbnail_writer = None
+        self.projection_only = False
+        self.flatfield_save = False
 
         
     def setup_figure(self):
@@ -80,6 +105,16 @@ class PlantTimeLapseDualMeasure(Measurement):
         cmap = pg.ColorMap(pos=np.linspace(0.0, 1.0, 6), color=colors)
         self.imv.setColorMap(cmap)
 
+        # browse the thumbnails of a saved file with the time slider
+        self.time_slider = pg.QtWidgets.QSlider(pg.QtCore.Qt.Orientation.Horizontal)
+        self.time_slider.setToolTip('time index of the browsed thumbnails')
+        self.time_slider.setMaximum(0)
+        self.ui.imageLayout.addWidget(self.time_slider, 1, 0)
+        self.settings.browse_file.add_listener(self.open_browse_file)
+        self.settings.browse_factor.add_listener(self.show_thumbnail)
+        self.settings.camera_in_use.add_listener(self.show_thumbnail)
+        self.time_slider.valueChanged.connect(self.show_thumbnail)
+
     def update_display(self):
         """
         Displays (plots) the numpy array self.buffer. 
@@ -92,25 +127,134 @@ class PlantTimeLapseDualMeasure(Measurement):
         self.settings['progress'] = (self.time_index + 1) * 100/length
 
         if hasattr(self, 'img'):
-            self.imv.setImage(self.img.T,
-                              autoLevels=self.settings['auto_levels'],
-                              autoRange=self.auto_range.val,
-                              levelMode='mono'
-                              )
-
-            if self.settings['auto_levels']:
-                lmin, lmax = self.imv.getHistogramWidget().getLevels()
-                self.settings['level_min'] = lmin
-                self.settings['level_max'] = lmax
-            else:
-                self.imv.setLevels(min=self.settings['level_min'],
-                                   max=self.settings['level_max'])
+            # the flat-field corrected images are in buffers that the acquisition reuses,
+            # and ImageView keeps a reference to the displayed array
+            self.show_image(self.img.copy())
+
+    def show_image(self, img):
+        self.imv.setImage(img.T,
+                          autoLevels=self.settings['auto_levels'],
+                          autoRange=self.auto_range.val,
+                          levelMode='mono'
+                          )
+
+        if self.settings['auto_levels']:
+            lmin, lmax = self.imv.getHistogramWidget().getLevels()
+            self.settings['level_min'] = lmin
+            self.settings['level_max'] = lmax
+        else:
+            self.imv.setLevels(min=self.settings['level_min'],
+                               max=self.settings['level_max'])
+
+    def open_browse_file(self):
+        if self.viewer is not None:
+            self.viewer.close()
+            self.viewer = None
+        fname = self.settings['browse_file']
+        if not os.path.isfile(fname):
+            return
+        try:
+            self.viewer = ThumbnailViewer(fname)
+        except (KeyError, OSError) as err:
+            print('cannot browse', fname, ':', err)
+            return
+        self.time_slider.setMaximum(max(self.viewer.num_timepoints - 1, 0))
+        self.show_thumbnail()
+
+    def browse_camera_idx(self):
+        return min(VIEWS[self.settings['camera_in_use']], self.viewer.camera_num - 1)
+
+    def show_thumbnail(self, *args):
+        """
+        Shows the thumbnail at the time index of the slider.
+        Thumbnails are not shown while measuring, to leave the display to the live images
+        """
+        if self.viewer is None or self.is_measuring():
+            return
+        time_idx = self.time_slider.value()
+        self.show_image(self.viewer.get(self.settings['browse_factor'],
+                                        time_idx,
+                                        self.browse_camera_idx()))
+
+    def show_montage(self):
+        if self.viewer is None or self.is_measuring():
+            return
+        self.show_image(self.viewer.montage(self.browse_camera_idx()))
+
+    def correct_frame(self, cam_idx, img, displayed=True):
+        """
+        Applies the flat-field correction, if enabled and if the camera is calibrated.
+        Returns the image to display and the image to save.
+        The display correction is only computed for the displayed camera.
+        flatfield_save is read once per timepoint, so that a dataset
+        does not mix raw and corrected frames
+        """
+        corrector = self.correctors[cam_idx]
+        if corrector is None:
+            return img, img
+        if self.flatfield_save:
+            img = corrector.correct_to_dtype(img)
+            return img, img
+        if displayed and self.settings['flatfield_display']:
+            return corrector.correct(img), img
+        return img, img
+
+    def check_disk(self, img):
+        """
+        Preflight of save_dir before the time-lapse starts.
+        Returns False if the run does not fit in the free space
+        """
+        frame_num = self.cameras[0].frame_num.val
+        self.timepoint_bytes = bytes_per_timepoint(img.shape, img.dtype, len(self.cameras), frame_num)
+        self.projection_bytes = bytes_per_timepoint(img.shape, img.dtype, len(self.cameras), 1)
+        if not self.settings['preflight_check']:
+            return True
+        self.create_saving_directory()
+        ok, messages = preflight(self.app.settings['save_dir'],
+                                 self.timepoint_bytes,
+                                 self.projection_bytes,
+                                 self.settings['time_lapse_num'],
+                                 self.settings['time_lapse_waiting_time'],
+                                 self.settings['free_space_margin']*GB,
+                                 self.settings['allow_projections'])
+        for message in messages:
+            print('preflight:', message)
+        return ok
+
+    def monitor_disk(self, write_time, camera_time):
+        """
+        Checks free space and write throughput after each timepoint.
+        When the disk gets full or too slow the run switches to saving
+        projections only, and stops if even these do not fit
+        """
+        action, reason = check_timepoint(self.app.settings['save_dir'],
+                                         self.settings['free_space_margin']*GB,
+                                         self.timepoint_bytes,
+                                         self.projection_bytes,
+                                         write_time,
+                                         camera_time,
+                                         self.settings['time_lapse_waiting_time'],
+                                         self.projection_only,
+                                         self.settings['allow_projections'])
+        if action == PROJECTIONS:
+            print('switching to projections only:', reason)
+            self.projection_only = True
+            # from this timepoint on the datasets have a single frame, the max projection
+            self.h5_group.attrs['projection_only_from_time_idx'] = self.time_index + 1
+            self.h5file.flush()
+        elif action == STOP:
+            print('stopping the acquisition:', reason)
+            self.interrupt()
+        elif action == SLOW:
+            print('the acquisition is falling behind:', reason)
 
     def measure(self):
         """
         Set mode to Multiframe, acquire Nframes frames and eventually save them in h5 
         """
         self.images = []
+        self.thumbnail_writer = None
+        self.projection_only = False
         
         time_lapse_num = self.settings['time_lapse_num'] 
         time_lapse_waiting_time = self.settings['time_lapse_waiting_time']
@@ -127,10 +271,13 @@ class PlantTimeLapseDualMeasure(Measurement):
             if self.interrupt_measurement_called:
                 break
             
+            timepoint_t0 = time.perf_counter()
             for L in self.leds:
                 L.turn_on()
             time.sleep(self.settings['LED_init_time']) # waiting time to turn on the LED
             first_frame_acquired = False
+            self.flatfield_save = self.settings['flatfield_save']
+            write_time = 0
             for c in self.cameras:
                 c.camera.acq_start()
             
@@ -139,13 +286,14 @@ class PlantTimeLapseDualMeasure(Measurement):
                 self.frame_index = frame_idx
                 
                 for cam_idx,cam in enumerate(self.cameras):
-                    img = cam.camera.get_nparray()
+                    displayed = cam_idx == VIEWS[self.settings['camera_in_use']]
+                    display_img, img = self.correct_frame(cam_idx, cam.camera.get_nparray(), displayed)
                     if first_frame_acquired:
                         self.images[cam_idx] = img
                     else:
                         self.images.append(img)
-                    if c == self.cameras[VIEWS[self.settings['camera_in_use']]]:
-                        self.img = img
+                    if displayed:
+                        self.img = display_img
                                 
                 if self.settings['save_h5']:
                     if not first_frame_acquired:
@@ -155,10 +303,21 @@ class PlantTimeLapseDualMeasure(Measurement):
                             self.init_h5_dataset(time_lapse_idx)
                         first_frame_acquired = True
     
+                    t0 = time.perf_counter()
                     for cam_idx,cam in enumerate(self.cameras):
-                        self.h5_datasets[cam_idx][frame_idx, :, :] = self.images[cam_idx]
+                        if self.projection_only:
+                            if self.projections[cam_idx] is None:
+                                self.projections[cam_idx] = self.images[cam_idx].copy()
+                            else:
+                                np.maximum(self.projections[cam_idx], self.images[cam_idx],
+                                           out=self.projections[cam_idx])
+                        elif self.h5_encoders:
+                            self.h5_encoders[cam_idx].write(frame_idx, self.images[cam_idx])
+                        else:
+                            self.h5_datasets[cam_idx][frame_idx, :, :] = self.images[cam_idx]
                     
                     self.h5file.flush()
+                    write_time += time.perf_counter() - t0
                 if self.interrupt_measurement_called:
                     break
 
@@ -166,11 +325,28 @@ class PlantTimeLapseDualMeasure(Measurement):
                 c.camera.acq_stop()
             for L in self.leds:
                 L.turn_off()
+            if self.projection_only and first_frame_acquired:
+                t0 = time.perf_counter()
+                for cam_idx,cam in enumerate(self.cameras):
+                    self.h5_datasets[cam_idx][0, :, :] = self.projections[cam_idx]
+                self.h5file.flush()
+                write_time += time.perf_counter() - t0
+            if self.thumbnail_writer is not None and first_frame_acquired:
+                # thumbnails of the last frame acquired by each camera
+                for cam_idx,cam in enumerate(self.cameras):
+                    self.thumbnail_writer.write(time_lapse_idx, cam_idx, self.images[cam_idx])
+                self.h5file.flush()
+            if first_frame_acquired:
+                camera_time = time.perf_counter() - timepoint_t0 - write_time
+                self.monitor_disk(write_time, camera_time)
             # wait for next time lapse measurevment
             while time.time()<self.initial_time+(time_lapse_idx+1)*time_lapse_waiting_time:
                 if self.interrupt_measurement_called:
                     break
 
+        if self.thumbnail_writer is not None:
+            self.thumbnail_writer.write_montage()
+
     def run(self):
         """
         Runs when measurement is started. Runs in a separate thread from GUI.
@@ -193,6 +369,12 @@ class PlantTimeLapseDualMeasure(Measurement):
         for c in self.cameras:
             c.read_from_hardware()
 
+        if self.settings['flatfield_display'] or self.settings['flatfield_save']:
+            self.correctors = [load_corrector(self.settings['calibration_dir'], c)
+                               for c in self.cameras]
+        else:
+            self.correctors = [None]*len(self.cameras)
+
         try:
             self.frame_index = -1
             self.time_index = -1
@@ -201,15 +383,18 @@ class PlantTimeLapseDualMeasure(Measurement):
                 c.camera.acq_start()
 
             while not self.interrupt_measurement_called:
-                c = self.cameras[VIEWS[self.settings['camera_in_use']]]
-                self.img = c.camera.get_nparray()
+                cam_idx = VIEWS[self.settings['camera_in_use']]
+                c = self.cameras[cam_idx]
+                self.flatfield_save = self.settings['flatfield_save']
+                self.img, img = self.correct_frame(cam_idx, c.camera.get_nparray())
 
                 if self.interrupt_measurement_called:
                     break
 
                 if self.settings['save_h5']:
                     # measure is triggered by save_h5 button
-                    self.measure()
+                    if self.check_disk(img):
+                        self.measure()
                     break
 
         finally:
@@ -240,27 +425,54 @@ class PlantTimeLapseDualMeasure(Measurement):
             app=self.app, measurement=self, fname=fname)
         self.h5_group = h5_io.h5_create_measurement_group(
             measurement=self, h5group=self.h5file)
+        # -1: all the timepoints are saved in full
+        self.h5_group.attrs['projection_only_from_time_idx'] = -1
         self.init_h5_dataset(time_idx=0)
+        if self.settings['save_thumbnails']:
+            self.thumbnail_writer = ThumbnailWriter(self.h5_group,
+                                                    self.settings['time_lapse_num'],
+                                                    len(self.cameras),
+                                                    self.images[0].shape,
+                                                    self.images[0].dtype)
 
 
     def init_h5_dataset(self,time_idx):
-        img_size = self.img.shape
-        dtype = self.img.dtype
+        # the saved images, since the displayed one may be flat-field corrected as float
+        img_size = self.images[0].shape
+        dtype = self.images[0].dtype
         actual_time = time.time()-self.initial_time
         print('measurement:', time_idx, 'at time:', actual_time )
         length = self.cameras[0].frame_num.val
+        if self.projection_only:
+            length = 1
+            self.projections = [None]*len(self.cameras)
         self.h5_datasets = []
+        self.h5_encoders = []
         for c_idx,c in enumerate(self.cameras):
             name = f't{time_idx:04d}/c{c_idx}/image'
-            dataset = self.h5_group.create_dataset(name=name,
-                                                    shape=[
-                                                    length, img_size[0], img_size[1]],
-                                                    dtype=dtype)
-            dataset.attrs['view'] = VIEWS[c_idx]
+            if self.settings['delta_mode'] and not self.projection_only:
+                dataset, frame_type = create_delta_dataset(self.h5_group, name,
+                                                           shape=[length, img_size[0], img_size[1]],
+                                                           dtype=dtype)
+                self.h5_encoders.append(DeltaFrameEncoder(dataset, frame_type,
+                                                          self.settings['keyframe_interval'],
+                                                          self.settings['skip_threshold']))
+            else:
+                dataset = self.h5_group.create_dataset(name=name,
+                                                        shape=[
+                                                        length, img_size[0], img_size[1]],
+                                                        dtype=dtype)
+            if self.projection_only:
+                dataset.attrs['projection'] = 'max'
+            dataset.attrs['view'] = list(VIEWS)[c_idx]
             dataset.attrs['time_idx'] = time_idx
             dataset.attrs['acquisition_time'] = actual_time
             dataset.attrs['frame_interval_s'] = self.settings['time_lapse_waiting_time']
             dataset.attrs['element_size_um'] = [self.settings['zsampling'],
                                                 self.settings['ysampling'],
                                                 self.settings['xsampling']]
+            corrector = self.correctors[c_idx]
+            dataset.attrs['flatfield_corrected'] = self.flatfield_save and corrector is not None
+            if dataset.attrs['flatfield_corrected']:
+                dataset.attrs['calibration_file'] = corrector.fname
             self.h5_datasets.append(dataset)
\ No newline at end of file
@@ -7,6 +7,7 @@ Created on Mar 20 12:45:26 2024
 from ScopeFoundry import Measurement
 from ScopeFoundry.helper_funcs import sibling_path, load_qt_ui_file
 from ScopeFoundry import h5_io
+from frame_delta import create_delta_dataset, DeltaFrameEncoder
 import pyqtgraph as pg
 import numpy as np
 import os
@@ -31,6 +32,10 @@ class PlantTimeLapseMeasure(Measurement):
         self.settings.New('save_h5', dtype=bool, initial=False)
         self.settings.New('refresh_period', dtype=float,
                           unit='s', spinbox_decimals=3, initial=0.05, vmin=0)
+        self.settings.New('delta_mode', dtype=bool, initial=False)
+        self.settings.New('keyframe_interval', dtype=int, initial=10, vmin=1)
+        self.settings.New('skip_threshold', dtype=float, unit='counts',
+                          initial=0.0, spinbox_decimals=2, vmin=0)
         self.settings.New('time_lapse_num', dtype=int,
                           initial=1)
         self.settings.New('time_lapse_waiting_time', dtype=float, unit='s',
@@ -152,7 +157,10 @@ class PlantTimeLapseMeasure(Measurement):
                             self.init_h5_dataset(time_lapse_idx)
                         first_frame_acquired = True
     
-                    self.image_h5[frame_idx, :, :] = self.img
+                    if self.h5_encoder is not None:
+                        self.h5_encoder.write(frame_idx, self.img)
+                    else:
+                        self.image_h5[frame_idx, :, :] = self.img
                     self.h5file.flush()
                 if self.interrupt_measurement_called:
                     break
@@ -237,10 +245,19 @@ class PlantTimeLapseMeasure(Measurement):
         print('measurement:', time_idx, 'at time:', actual_time )
 
         length = self.cameras[0].frame_num.val
-        self.image_h5 = self.h5_group.create_dataset(name=name,
-                                                     shape=[
-                                                     length, img_size[0], img_size[1]],
-                                                     dtype=dtype)
+        if self.settings['delta_mode']:
+            self.image_h5, frame_type = create_delta_dataset(self.h5_group, name,
+                                                             shape=[length, img_size[0], img_size[1]],
+                                                             dtype=dtype)
+            self.h5_encoder = DeltaFrameEncoder(self.image_h5, frame_type,
+                                                self.settings['keyframe_interval'],
+                                                self.settings['skip_threshold'])
+        else:
+            self.h5_encoder = None
+            self.image_h5 = self.h5_group.create_dataset(name=name,
+                                                         shape=[
+                                                         length, img_size[0], img_size[1]],
+                                                         dtype=dtype)
         self.image_h5.attrs['time_idx'] = time_idx
         self.image_h5.attrs['acquisition_time'] = actual_time
         self.image_h5.attrs['frame_interval_s'] = self.settings['time_lapse_waiting_time']
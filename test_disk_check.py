@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Decisions of the disk checks in disk_check, with the free space mocked.
+"""
+import disk_check
+from disk_check import check_timepoint, preflight, CONTINUE, SLOW, PROJECTIONS, STOP, MB, GB
+import pytest
+
+TIMEPOINT = 100*MB
+PROJECTION = 10*MB
+
+
+@pytest.fixture
+def free(monkeypatch):
+    """ sets the free space seen by disk_check """
+    space = {'free': 100*GB}
+    monkeypatch.setattr(disk_check, 'free_space', lambda directory: space['free'])
+    return space
+
+
+def check(write_time=0.1, camera_time=0.5, waiting_time=2.0,
+          projection_only=False, allow_projections=True):
+    return check_timepoint('save_dir', 0, TIMEPOINT, PROJECTION,
+                           write_time, camera_time, waiting_time,
+                           projection_only, allow_projections)[0]
+
+
+def test_healthy_disk_continues(free):
+    assert check() == CONTINUE
+
+
+@pytest.mark.parametrize('waiting_time, camera_time', [(0.0, 0.5),   # back-to-back timepoints
+                                                       (1.0, 1.5),   # burst longer than the interval
+                                                       (1.0, 1.0)])
+def test_no_time_left_by_the_cameras_is_not_blamed_on_the_disk(free, waiting_time, camera_time):
+    assert check(write_time=5.0, camera_time=camera_time, waiting_time=waiting_time) == CONTINUE
+
+
+def test_slow_disk_switches_to_projections(free):
+    # 1.6 s of writing, only 1.5 s left by the cameras
+    assert check(write_time=1.6, camera_time=0.5, waiting_time=2.0) == PROJECTIONS
+    assert check(write_time=1.4, camera_time=0.5, waiting_time=2.0) == CONTINUE
+
+
+def test_slow_disk_only_warns_without_projections(free):
+    assert check(write_time=1.6, allow_projections=False) == SLOW
+
+
+def test_full_disk(free):
+    free['free'] = TIMEPOINT - 1
+    assert check() == PROJECTIONS
+    assert check(allow_projections=False) == STOP
+    free['free'] = PROJECTION - 1
+    assert check() == STOP
+
+
+def test_projection_only_stops_when_projections_do_not_fit(free):
+    free['free'] = PROJECTION
+    assert check(projection_only=True, write_time=100.0) == CONTINUE
+    free['free'] = PROJECTION - 1
+    assert check(projection_only=True) == STOP
+
+
+def test_margin_is_subtracted(free):
+    free['free'] = TIMEPOINT + GB
+    assert check_timepoint('save_dir', GB, TIMEPOINT, PROJECTION,
+                           0.1, 0.5, 2.0, False, True)[0] == CONTINUE
+    assert check_timepoint('save_dir', GB + 1, TIMEPOINT, PROJECTION,
+                           0.1, 0.5, 2.0, False, True)[0] == PROJECTIONS
+
+
+def test_preflight_refuses_without_benchmark(free, monkeypatch):
+    def benchmark(*args):
+        raise AssertionError('benchmark run on a refused preflight')
+    monkeypatch.setattr(disk_check, 'benchmark_write_speed', benchmark)
+    free['free'] = 5*TIMEPOINT
+    ok, messages = preflight('save_dir', TIMEPOINT, PROJECTION, 100, 2.0, 0, True)
+    assert not ok
+    ok, messages = preflight('save_dir', TIMEPOINT, PROJECTION, 10, 2.0, 0, False)
+    assert not ok
+
+
+def test_preflight_warns_when_projections_fit(free, monkeypatch):
+    monkeypatch.setattr(disk_check, 'benchmark_write_speed', lambda directory, size: 1000*MB)
+    free['free'] = 5*TIMEPOINT
+    ok, messages = preflight('save_dir', TIMEPOINT, PROJECTION, 10, 2.0, 0, True)
+    assert ok
+    assert any('switch to projections' in m for m in messages)
+
+
+def test_preflight_reports_benchmark_errors(free, monkeypatch):
+    def benchmark(directory, size):
+        assert size <= free['free'] // 4
+        raise OSError(28, 'No space left on device')
+    monkeypatch.setattr(disk_check, 'benchmark_write_speed', benchmark)
+    free['free'] = 100*TIMEPOINT
+    ok, messages = preflight('save_dir', TIMEPOINT, PROJECTION, 10, 2.0, 0, True)
+    assert ok
+    assert any('benchmark failed' in m for m in messages)
+
+
+def test_preflight_warns_about_slow_disk(free, monkeypatch):
+    monkeypatch.setattr(disk_check, 'benchmark_write_speed', lambda directory, size: 10*MB)
+    ok, messages = preflight('save_dir', TIMEPOINT, PROJECTION, 10, 2.0, 0, True)
+    assert ok
+    assert any('slower than the data rate' in m for m in messages)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Round trip of the delta encoding in frame_delta,
+with numpy arrays in place of the h5 datasets.
+"""
+from frame_delta import DeltaFrameEncoder, DeltaFrameReader, KEYFRAME, DELTA, SKIPPED
+import numpy as np
+import pytest
+
+
+class ArrayDataset(np.ndarray):
+    """ numpy stand-in for an h5py dataset, with attrs """
+
+
+def make_dataset(shape, dtype):
+    dataset = np.zeros(shape, dtype=dtype).view(ArrayDataset)
+    dataset.attrs = {}
+    return dataset
+
+
+def make_frames(num=12, shape=(6, 5), seed=0):
+    rng = np.random.default_rng(seed)
+    frames = rng.integers(0, 2**16, size=(num,) + shape, dtype=np.uint16)
+    # values at both ends of the range, so that the differences wrap around
+    frames[2] = 65535
+    frames[3] = 0
+    frames[4] = frames[3]   # identical frames are skipped
+    frames[5] = frames[3]
+    frames[9] = frames[8]
+    return frames
+
+
+def encode(frames, keyframe_interval=3, skip_threshold=0.0):
+    dataset = make_dataset(frames.shape, frames.dtype)
+    frame_type = np.zeros(len(frames), dtype=np.uint8)
+    encoder = DeltaFrameEncoder(dataset, frame_type, keyframe_interval, skip_threshold)
+    for idx, img in enumerate(frames):
+        encoder.write(idx, img)
+    return DeltaFrameReader(dataset, frame_type)
+
+
+def test_frame_types():
+    reader = encode(make_frames())
+    assert list(reader.frame_type) == [KEYFRAME, DELTA, DELTA,
+                                       KEYFRAME, SKIPPED, SKIPPED,
+                                       DELTA, DELTA, KEYFRAME,
+                                       SKIPPED, DELTA, DELTA]
+    assert not reader.dataset[4].any() and not reader.dataset[9].any()
+
+
+def test_lossless_sequential_random_and_reverse():
+    frames = make_frames()
+    reader = encode(frames)
+    for idx in range(len(frames)):
+        np.testing.assert_array_equal(reader[idx], frames[idx])
+    order = np.random.default_rng(1).permutation(len(frames))
+    for idx in order:
+        np.testing.assert_array_equal(reader[idx], frames[idx])
+    for idx in reversed(range(len(frames))):
+        np.testing.assert_array_equal(reader[idx], frames[idx])
+    np.testing.assert_array_equal(reader[-1], frames[-1])
+
+
+def test_returned_frames_are_copies():
+    frames = make_frames()
+    reader = encode(frames)
+    reader[7][:] = 0
+    np.testing.assert_array_equal(reader[7], frames[7])
+
+
+@pytest.mark.parametrize('key', [slice(None),
+                                 slice(2, 10, 3),
+                                 slice(None, None, -1),
+                                 slice(5, 5),
+                                 (slice(1, 8), 2),
+                                 (slice(None), slice(1, 3), slice(None, None, 2)),
+                                 (4, slice(2, 4)),
+                                 (),
+                                 Ellipsis,
+                                 (Ellipsis, 1),
+                                 [7, 0, 11, 4],
+                                 np.array([3, 3, 9]),
+                                 np.arange(12) % 2 == 0,
+                                 np.int64(10)])
+def test_indexing_like_a_dataset(key):
+    frames = make_frames()
+    reader = encode(frames)
+    np.testing.assert_array_equal(reader[key], frames[key])
+
+
+def test_array_conversion_and_errors():
+    frames = make_frames()
+    reader = encode(frames)
+    np.testing.assert_array_equal(np.asarray(reader), frames)
+    with pytest.raises(IndexError):
+        reader[12]
+    with pytest.raises(TypeError):
+        reader[np.array([0.5, 1.5])]
+
+
+def test_skip_threshold_keeps_previous_stored_frame():
+    frames = np.full((4, 3, 3), 1000, dtype=np.uint16)
+    frames[1, 0, 0] = 1001   # mean change 1/9 count: skipped
+    frames[2:] = 1500
+    frames[3, 1, 1] = 1499
+    reader = encode(frames, keyframe_interval=10, skip_threshold=1.0)
+    assert list(reader.frame_type) == [KEYFRAME, SKIPPED, DELTA, SKIPPED]
+    np.testing.assert_array_equal(reader[1], frames[0])
+    np.testing.assert_array_equal(reader[3], frames[2])
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Oct 19 11:48:15 2026
+
+@authors: Andrea Bassi. Politecnico di Milano
+
+Thumbnail pyramid of a time-lapse, saved in the h5 file during acquisition.
+For each level the group 'thumbnails' contains a dataset level{factor}
+with shape [time_lapse_num, camera_num, height//factor, width//factor],
+and at the end of the acquisition a contact-sheet montage_c{camera}
+of the coarsest level.
+"""
+from functools import lru_cache
+import h5py
+import numpy as np
+
+THUMBNAIL_FACTORS = (8, 32)
+
+
+def downsample(img, factor):
+    """
+    Block average of img over factor x factor pixels.
+    The borders that do not fill a block are cropped.
+    """
+    height = img.shape[0] // factor
+    width = img.shape[1] // factor
+    blocks = img[:height*factor, :width*factor].reshape(height, factor, width, factor)
+    return blocks.mean(axis=(1, 3), dtype=np.float32).astype(img.dtype)
+
+
+def make_montage(thumbs, ncols=None):
+    """
+    Tiles the thumbs [N, height, width] in a grid with ncols columns
+    """
+    num, height, width = thumbs.shape
+    if ncols is None:
+        ncols = max(int(np.ceil(np.sqrt(num))), 1)
+    nrows = max(int(np.ceil(num / ncols)), 1)
+    montage = np.zeros([nrows*height, ncols*width], dtype=thumbs.dtype)
+    for idx in range(num):
+        row, col = divmod(idx, ncols)
+        montage[row*height:(row+1)*height, col*width:(col+1)*width] = thumbs[idx]
+    return montage
+
+
+class ThumbnailWriter:
+
+    def __init__(self, h5group, time_lapse_num, camera_num, img_shape, dtype,
+                 factors=THUMBNAIL_FACTORS):
+        self.group = h5group.create_group('thumbnails')
+        self.factors = sorted(factors)
+        self.datasets = {}
+        for factor in self.factors:
+            shape = [time_lapse_num, camera_num, img_shape[0]//factor, img_shape[1]//factor]
+            self.datasets[factor] = self.group.create_dataset(name=f'level{factor}',
+                                                              shape=shape,
+                                                              dtype=dtype)
+        self.group.attrs['factors'] = self.factors
+        self.group.attrs['num_timepoints'] = 0
+
+    def write(self, time_idx, cam_idx, img):
+        """
+        Each level is computed from the previous one,
+        so the full frame is read only once
+        """
+        thumb = img
+        previous_factor = 1
+        for factor in self.factors:
+            thumb = downsample(thumb, factor // previous_factor)
+            self.datasets[factor][time_idx, cam_idx, :, :] = thumb
+            previous_factor = factor
+        self.group.attrs['num_timepoints'] = max(time_idx + 1,
+                                                 self.group.attrs['num_timepoints'])
+
+    def write_montage(self):
+        factor = self.factors[-1]
+        dataset = self.datasets[factor]
+        num = self.group.attrs['num_timepoints']
+        for cam_idx in range(dataset.shape[1]):
+            montage = make_montage(dataset[:num, cam_idx])
+            montage_h5 = self.group.create_dataset(name=f'montage_c{cam_idx}', data=montage)
+            montage_h5.attrs['factor'] = factor
+
+
+class ThumbnailViewer:
+    """
+    Reads the thumbnails saved in a time-lapse h5 file.
+    The last cache_size thumbnails read are kept in memory.
+    """
+
+    def __init__(self, fname, cache_size=512):
+        self.h5file = h5py.File(fname, 'r')
+        self.group = None
+        self.h5file.visit(self._find_thumbnails)
+        if self.group is None:
+            self.h5file.close()
+            raise KeyError(f'no thumbnails saved in {fname}')
+        self.factors = list(self.group.attrs['factors'])
+        self.num_timepoints = int(self.group.attrs['num_timepoints'])
+        self.camera_num = self.group[f'level{self.factors[0]}'].shape[1]
+        self.get = lru_cache(maxsize=cache_size)(self._read)
+
+    def _find_thumbnails(self, name):
+        if name.split('/')[-1] == 'thumbnails':
+            self.group = self.h5file[name]
+            return True
+
+    def _read(self, factor, time_idx, cam_idx):
+        return self.group[f'level{factor}'][time_idx, cam_idx]
+
+    def montage(self, cam_idx):
+        name = f'montage_c{cam_idx}'
+        if name in self.group:
+            return self.group[name][()]
+        # acquisition interrupted before the montage was saved
+        factor = self.factors[-1]
+        return make_montage(self.group[f'level{factor}'][:self.num_timepoints, cam_idx])
+
+    def close(self):
+        self.get.cache_clear()
+        self.h5file.close()